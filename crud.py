@@ -2,9 +2,10 @@ import json
 from sqlalchemy.orm import Session
 from models import MealLog
 from schemas import MealCreateRequest
+from services.meal_archive import delete_archived_meal, list_archived_meals_range, merge_meals
 
 
-def create_meal(db: Session, user_id: str, email: str, req: MealCreateRequest) -> MealLog:
+def create_meal(db: Session, user_id: str, email: str, req: MealCreateRequest, commit: bool = True) -> MealLog:
     warnings_json = json.dumps(req.warnings, ensure_ascii=False)
     row = MealLog(
         user_id=user_id,
@@ -20,34 +21,42 @@ def create_meal(db: Session, user_id: str, email: str, req: MealCreateRequest) -
         warnings=warnings_json,
     )
     db.add(row)
+    if not commit:
+        # 호출자가 다른 기록(idempotency 등)과 같은 트랜잭션으로 commit 한다
+        db.flush()
+        return row
     db.commit()
     db.refresh(row)
     return row
 
 
 def list_meals_by_date(db: Session, user_id: str, meal_date: str) -> list[MealLog]:
-    return (
+    rows = (
         db.query(MealLog)
         .filter(MealLog.user_id == user_id, MealLog.meal_date == meal_date)
         .order_by(MealLog.created_at.desc())
         .all()
     )
+    return merge_meals(rows, list_archived_meals_range(db, user_id, meal_date, meal_date))
 
 
 def list_meals_range(db: Session, user_id: str, start_date: str, end_date: str) -> list[MealLog]:
     # 문자열 비교가 YYYY-MM-DD에서 정렬/범위 비교 동작
-    return (
+    rows = (
         db.query(MealLog)
         .filter(MealLog.user_id == user_id, MealLog.meal_date >= start_date, MealLog.meal_date <= end_date)
         .order_by(MealLog.meal_date.asc(), MealLog.created_at.desc())
         .all()
     )
+    # 오래된 달은 아카이브 파일에 있으므로 같이 읽어서 합침
+    return merge_meals(rows, list_archived_meals_range(db, user_id, start_date, end_date))
 
 
 def delete_meal(db: Session, user_id: str, meal_id: int) -> bool:
     row = db.query(MealLog).filter(MealLog.user_id == user_id, MealLog.id == meal_id).first()
     if not row:
-        return False
+        # 목록에는 아카이브된 기록도 나오므로 삭제도 아카이브까지 확인
+        return delete_archived_meal(db, user_id=user_id, meal_id=meal_id)
     db.delete(row)
     db.commit()
     return True
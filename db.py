@@ -1,5 +1,6 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./foodie.db")
@@ -26,3 +27,16 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def ensure_tables(*tables) -> None:
+    """
+    앱 시작/배치 실행 시 테이블이 없으면 만든다.
+    워커 여러 개가 동시에 떠서 같은 테이블을 만들다 실패해도, 결국 테이블이 있으면 넘어간다.
+    """
+    for table in tables:
+        try:
+            table.create(bind=engine, checkfirst=True)
+        except DBAPIError:
+            if not inspect(engine).has_table(table.name):
+                raise
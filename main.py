@@ -1,14 +1,28 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from db import ensure_tables
+from models import IdempotencyRecord, MealArchive
+
 # routers 패키지에서 import (정답)
 from routers.meals import router as meals_router
 from routers.profile import router as profile_router
 from routers.summary import router as summary_router
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 요청 경로에서 DDL을 돌리지 않도록 시작할 때 한 번 만든다
+    ensure_tables(IdempotencyRecord.__table__, MealArchive.__table__)
+    yield
+
+
 app = FastAPI(
     title="Foodie API",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -1,4 +1,4 @@
-from sqlalchemy import String, Float, DateTime, Text, Index
+from sqlalchemy import String, Float, DateTime, Text, Index, LargeBinary
 from sqlalchemy.orm import Mapped, mapped_column
 from datetime import datetime, timezone
 
@@ -7,6 +7,8 @@ from db import Base
 
 class MealLog(Base):
     __tablename__ = "meal_logs"
+    # 아카이브가 최신 id를 지워도 SQLite가 그 id를 재사용하지 않도록 (Postgres는 시퀀스라 해당 없음)
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
 
@@ -37,3 +39,60 @@ class MealLog(Base):
 
 
 Index("ix_meal_logs_user_date", MealLog.user_id, MealLog.meal_date)
+
+
+class MealArchive(Base):
+    """
+    오래된 meal_logs를 (user_id, 월) 단위로 압축해 둔 아카이브.
+    data: gzip(JSON {"columns": {컬럼명: [값...]}}) - 한 사용자 한 달치만 풀면 된다.
+    """
+    __tablename__ = "meal_archives"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+
+    user_id: Mapped[str] = mapped_column(String(128))
+    month: Mapped[str] = mapped_column(String(7))          # "YYYY-MM"
+
+    # 삭제 시 어떤 아카이브에 있는지 풀어보지 않고 찾기 위한 id 범위
+    min_meal_id: Mapped[int] = mapped_column()
+    max_meal_id: Mapped[int] = mapped_column()
+    row_count: Mapped[int] = mapped_column(default=0)
+    data: Mapped[bytes] = mapped_column(LargeBinary)
+
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+    )
+
+
+Index("ux_meal_archives_user_month", MealArchive.user_id, MealArchive.month, unique=True)
+
+
+class IdempotencyRecord(Base):
+    """
+    Idempotency-Key 로 처리된 요청의 응답 스냅샷.
+    (user_id, scope, key) 단위로 한 번만 실행되도록 보장한다.
+    """
+    __tablename__ = "idempotency_keys"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+
+    user_id: Mapped[str] = mapped_column(String(128))
+    scope: Mapped[str] = mapped_column(String(32))        # "meals.create" | "analyze.text" | ...
+    key: Mapped[str] = mapped_column(String(128))
+
+    # 같은 key로 다른 payload가 오면 거절하기 위한 요청 해시 (sha256 hex)
+    request_hash: Mapped[str] = mapped_column(String(64))
+    # "pending": 실행 중 (다른 워커/레플리카는 이 row를 보고 기다림) | "done": response_body 확정
+    status: Mapped[str] = mapped_column(String(16), default="pending")
+    status_code: Mapped[int] = mapped_column(default=200)
+    response_body: Mapped[str] = mapped_column(Text, default="")  # JSON string
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+    )
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+
+
+Index("ux_idempotency_keys_user_scope_key", IdempotencyRecord.user_id, IdempotencyRecord.scope, IdempotencyRecord.key, unique=True)
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi import APIRouter, Depends, UploadFile, File, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
 from security import get_current_user
 from services.openai_client import analyze_food_text, analyze_food_image
+from services.idempotency import run_idempotent
 
 router = APIRouter(tags=["analyze"])
 
@@ -20,23 +22,55 @@ class AnalyzeResponse(BaseModel):
 
 
 @router.post("/analyze", response_model=AnalyzeResponse)
-async def analyze_text(req: AnalyzeTextRequest, user=Depends(get_current_user)):
+async def analyze_text(
+    req: AnalyzeTextRequest,
+    user=Depends(get_current_user),
+    idempotency_key: str | None = Header(default=None),
+):
+    # 같은 Idempotency-Key 재시도는 OpenAI를 다시 부르지 않고 저장된 결과를 반환
+    # (중복 요청 대기가 이벤트 루프를 막지 않도록 threadpool에서 실행)
     try:
-        return analyze_food_text(req.text)
+        return await run_in_threadpool(
+            run_idempotent,
+            "analyze.text",
+            user["sub"],
+            idempotency_key,
+            req,
+            lambda: analyze_food_text(req.text),
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/analyze/image", response_model=AnalyzeResponse)
-async def analyze_image(image: UploadFile = File(...), user=Depends(get_current_user)):
+async def analyze_image(
+    image: UploadFile = File(...),
+    user=Depends(get_current_user),
+    idempotency_key: str | None = Header(default=None),
+):
     try:
         data = await image.read()
-        return analyze_food_image(data)
+        return await run_in_threadpool(
+            run_idempotent,
+            "analyze.image",
+            user["sub"],
+            idempotency_key,
+            data,
+            lambda: analyze_food_image(data),
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # ---- 호환용 alias (필요하면 앱/스크립트가 이쪽을 칠 수도 있음)
 @router.post("/analyze/text", response_model=AnalyzeResponse)
-async def analyze_text_alias(req: AnalyzeTextRequest, user=Depends(get_current_user)):
-    return await analyze_text(req, user)
+async def analyze_text_alias(
+    req: AnalyzeTextRequest,
+    user=Depends(get_current_user),
+    idempotency_key: str | None = Header(default=None),
+):
+    return await analyze_text(req, user, idempotency_key)
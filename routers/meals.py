@@ -1,5 +1,5 @@
 import json
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
@@ -7,14 +7,35 @@ from db import get_db
 from security import get_current_user
 from schemas import MealCreateRequest, MealOut, MealDeleteResponse
 from crud import create_meal, list_meals_by_date, list_meals_range, delete_meal
+from services.idempotency import run_idempotent
 
 router = APIRouter(prefix="/meals", tags=["meals"])
 
 
 @router.post("", response_model=MealOut)
-def add_meal(req: MealCreateRequest, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    user_id, email = user
-    row = create_meal(db, user_id=user_id, email=email, req=req)
+def add_meal(
+    req: MealCreateRequest,
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+    idempotency_key: str | None = Header(default=None),
+):
+    # get_current_user는 JWT payload(dict)를 돌려줌
+    user_id, email = user["sub"], user.get("email", "")
+
+    # 재시도(같은 Idempotency-Key)면 MealLog를 새로 만들지 않고 첫 응답을 그대로 돌려줌
+    # MealLog insert와 idempotency 기록은 같은 트랜잭션으로 commit 됨
+    return run_idempotent(
+        "meals.create",
+        user_id,
+        idempotency_key,
+        req,
+        lambda: _create_meal_out(db, user_id, email, req),
+        db=db,
+    )
+
+
+def _create_meal_out(db: Session, user_id: str, email: str, req: MealCreateRequest) -> MealOut:
+    row = create_meal(db, user_id=user_id, email=email, req=req, commit=False)
 
     # warnings는 DB에 JSON string이라 변환해서 내려줌
     warnings = []
@@ -48,7 +69,7 @@ def get_meals(
     start: str | None = Query(default=None, description="YYYY-MM-DD"),
     end: str | None = Query(default=None, description="YYYY-MM-DD"),
 ):
-    user_id, _ = user
+    user_id = user["sub"]
 
     if date:
         rows = list_meals_by_date(db, user_id=user_id, meal_date=date)
@@ -85,7 +106,7 @@ def get_meals(
 
 @router.delete("/{meal_id}", response_model=MealDeleteResponse)
 def remove_meal(meal_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    user_id, _ = user
+    user_id = user["sub"]
     ok = delete_meal(db, user_id=user_id, meal_id=meal_id)
     if not ok:
         raise HTTPException(status_code=404, detail="Not found")
@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from db import SessionLocal
+from models import IdempotencyRecord
+
+# 모바일 재시도는 보통 수 분 안에 끝나지만, 앱 재시작 후 재전송까지 고려해 넉넉히 유지
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))  # 24시간
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+# pending 예약을 잡은 워커가 죽었다고 보고 다른 요청이 이어받기까지의 시간 (OpenAI 호출보다 길게)
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "120"))
+IDEMPOTENCY_HOT_MAX = int(os.getenv("IDEMPOTENCY_HOT_MAX", "10000"))
+_POLL_SECONDS = 0.2
+_PURGE_INTERVAL_SECONDS = 600
+_MAX_KEY_LENGTH = 128
+
+_Ident = Tuple[str, str, str]  # (user_id, scope, key)
+
+_lock = threading.Lock()
+# 메모리 hot index: ident -> (만료 monotonic 시각, request_hash, response_body JSON)
+_hot: "OrderedDict[_Ident, Tuple[float, str, str]]" = OrderedDict()
+# 같은 프로세스 안의 동시 요청은 DB를 polling 하지 않고 첫 요청이 끝나길 기다린다
+_inflight: Dict[_Ident, threading.Event] = {}
+
+_last_purge = 0.0
+
+
+def _hash_payload(payload: Any) -> str:
+    if isinstance(payload, bytes):
+        raw = payload
+    else:
+        raw = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _hot_get(ident: _Ident) -> Optional[Tuple[str, str]]:
+    entry = _hot.get(ident)
+    if entry is None:
+        return None
+    expires, request_hash, body = entry
+    if expires <= time.monotonic():
+        del _hot[ident]
+        return None
+    _hot.move_to_end(ident)
+    return request_hash, body
+
+
+def _hot_put(ident: _Ident, request_hash: str, body: str, ttl: float) -> None:
+    if ttl <= 0:
+        return
+    _hot[ident] = (time.monotonic() + ttl, request_hash, body)
+    _hot.move_to_end(ident)
+    while len(_hot) > IDEMPOTENCY_HOT_MAX:
+        _hot.popitem(last=False)
+
+
+def _check_hash(request_hash: str, stored_hash: str) -> None:
+    if stored_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key reused with a different request")
+
+
+def _to_utc(dt: datetime) -> datetime:
+    # SQLite는 tz 정보를 버리므로 UTC로 간주
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def _filter(query, ident: _Ident):
+    user_id, scope, key = ident
+    return query.filter(
+        IdempotencyRecord.user_id == user_id,
+        IdempotencyRecord.scope == scope,
+        IdempotencyRecord.key == key,
+    )
+
+
+def _load(ident: _Ident) -> Optional[IdempotencyRecord]:
+    with SessionLocal() as db:
+        row = _filter(db.query(IdempotencyRecord), ident).first()
+        if row is None:
+            return None
+        if _to_utc(row.expires_at) <= datetime.now(timezone.utc):
+            db.delete(row)
+            db.commit()
+            return None
+        db.expunge(row)
+        return row
+
+
+def _claim(ident: _Ident, request_hash: str) -> Tuple[Optional[IdempotencyRecord], Optional[datetime]]:
+    """
+    unique index 위에 pending row를 넣어서 key를 예약한다. (워커/레플리카 간 중복 실행 방지)
+    예약(또는 lease 만료된 예약 인수)에 성공하면 (None, lease 토큰), 이미 누가 잡고 있으면 (그 row, None).
+    lease 토큰은 이번 요청이 기록한 created_at 값이고, _finish/_release가 소유 확인에 쓴다.
+    """
+    user_id, scope, key = ident
+    while True:
+        now = datetime.now(timezone.utc)
+        with SessionLocal() as db:
+            db.add(
+                IdempotencyRecord(
+                    user_id=user_id,
+                    scope=scope,
+                    key=key,
+                    request_hash=request_hash,
+                    status="pending",
+                    response_body="",
+                    created_at=now,
+                    expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+                )
+            )
+            try:
+                db.commit()
+                return None, now
+            except IntegrityError:
+                db.rollback()
+
+        row = _load(ident)
+        if row is None:
+            # 만료됐거나 실행이 실패해서 예약이 풀림 -> 다시 예약 시도
+            continue
+        if row.status == "pending" and row.request_hash == request_hash:
+            # 예약한 워커가 lease 안에 끝내지 못함(죽었다고 봄) -> 조건부 UPDATE로 한 요청만 이어받는다
+            stale_before = now - timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+            with SessionLocal() as db:
+                taken = (
+                    _filter(db.query(IdempotencyRecord), ident)
+                    .filter(IdempotencyRecord.status == "pending", IdempotencyRecord.created_at < stale_before)
+                    .update({IdempotencyRecord.created_at: now}, synchronize_session=False)
+                )
+                db.commit()
+            if taken:
+                return None, now
+        return row, None
+
+
+def _owned(query, ident: _Ident, token: datetime):
+    # lease를 다른 요청이 인수했으면 created_at이 바뀌어 있으므로 0 rows
+    return _filter(query, ident).filter(
+        IdempotencyRecord.status == "pending",
+        IdempotencyRecord.created_at == token,
+    )
+
+
+def _release(ident: _Ident, token: datetime) -> None:
+    # 실행 실패: 내 예약만 지워서 클라이언트가 같은 key로 재시도할 수 있게 한다
+    with SessionLocal() as db:
+        _owned(db.query(IdempotencyRecord), ident, token).delete(synchronize_session=False)
+        db.commit()
+
+
+def _finish(ident: _Ident, token: datetime, body: str, db: Session) -> bool:
+    """내 예약을 done으로 바꾸고 commit. lease를 잃었으면 db를 rollback 하고 False."""
+    now = datetime.now(timezone.utc)
+    updated = _owned(db.query(IdempotencyRecord), ident, token).update(
+        {
+            IdempotencyRecord.status: "done",
+            IdempotencyRecord.status_code: 200,
+            IdempotencyRecord.response_body: body,
+            IdempotencyRecord.expires_at: now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+        },
+        synchronize_session=False,
+    )
+    if updated != 1:
+        # 다른 요청이 이미 이어받아 실행 중/완료 -> 이번 쓰기(MealLog 등)는 버린다
+        db.rollback()
+        return False
+    db.commit()
+    return True
+
+
+def _maybe_purge() -> None:
+    global _last_purge
+    now = time.monotonic()
+    if now - _last_purge < _PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = now
+    with SessionLocal() as db:
+        db.query(IdempotencyRecord).filter(
+            IdempotencyRecord.expires_at <= datetime.now(timezone.utc)
+        ).delete(synchronize_session=False)
+        db.commit()
+
+
+def run_idempotent(
+    scope: str,
+    user_id: str,
+    key: Optional[str],
+    payload: Any,
+    fn: Callable[[], Any],
+    db: Optional[Session] = None,
+) -> Any:
+    """
+    Idempotency-Key 헤더가 있으면 (user_id, scope, key) 당 fn을 한 번만 실행한다.
+    - 이미 처리된 key: 저장된 응답(JSON)을 그대로 돌려준다 (DB write / LLM 호출 없음)
+    - 처리 중인 key: 첫 요청이 끝날 때까지 기다렸다가 그 결과를 돌려준다 (다른 워커/레플리카 포함)
+    - 같은 key에 다른 payload: 422
+    db를 주면 fn은 commit 하지 않아야 하고, fn의 쓰기와 idempotency 기록을 같은 트랜잭션으로 commit 한다.
+    fn이 예외를 내면 예약을 풀어주므로 클라이언트는 같은 key로 재시도할 수 있다.
+    """
+    if not key:
+        result = fn()
+        if db is not None:
+            db.commit()
+        return result
+    if len(key) > _MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Key too long")
+
+    ident: _Ident = (user_id, scope, key)
+    request_hash = _hash_payload(payload)
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+
+    while True:
+        with _lock:
+            cached = _hot_get(ident)
+            if cached is not None:
+                _check_hash(request_hash, cached[0])
+                return json.loads(cached[1])
+            event = _inflight.get(ident)
+            if event is None:
+                event = threading.Event()
+                _inflight[ident] = event
+                break
+
+        if not event.wait(timeout=max(deadline - time.monotonic(), 0)):
+            raise HTTPException(status_code=409, detail="Request with this Idempotency-Key is still in progress")
+        # 첫 요청이 끝났음 -> hot index를 다시 확인 (실패했다면 이번 요청이 이어받아 실행)
+
+    try:
+        while True:
+            row, token = _claim(ident, request_hash)
+            if row is None:
+                break
+            _check_hash(request_hash, row.request_hash)
+            if row.status == "done":
+                ttl = (_to_utc(row.expires_at) - datetime.now(timezone.utc)).total_seconds()
+                with _lock:
+                    _hot_put(ident, row.request_hash, row.response_body, ttl)
+                return json.loads(row.response_body)
+            # 다른 프로세스가 실행 중
+            if time.monotonic() >= deadline:
+                raise HTTPException(status_code=409, detail="Request with this Idempotency-Key is still in progress")
+            time.sleep(_POLL_SECONDS)
+
+        try:
+            result = fn()
+            body = json.dumps(jsonable_encoder(result), ensure_ascii=False)
+            if db is not None:
+                finished = _finish(ident, token, body, db)
+            else:
+                with SessionLocal() as own:
+                    finished = _finish(ident, token, body, own)
+        except BaseException:
+            if db is not None:
+                db.rollback()
+            _release(ident, token)
+            raise
+        if not finished:
+            raise HTTPException(status_code=409, detail="Request with this Idempotency-Key was taken over by a retry")
+
+        with _lock:
+            _hot_put(ident, request_hash, body, IDEMPOTENCY_TTL_SECONDS)
+        _maybe_purge()
+        return result
+    finally:
+        with _lock:
+            _inflight.pop(ident, None)
+        event.set()
@@ -0,0 +1,270 @@
+# 오래된 meal_logs를 (user_id, 월) 단위 압축 columnar blob으로 옮기는 아카이브
+# - 저장소: 같은 DB의 meal_archives 테이블 (models.MealArchive)
+#   로컬 디스크가 아니라 DB에 두기 때문에 cron 컨테이너/웹 레플리카 모두 같은 아카이브를 본다.
+# - 아카이브 쓰기와 meal_logs 삭제는 한 트랜잭션이라 중간에 죽어도 유실/중복 노출이 없다.
+# - 실행: python -m services.meal_archive  (Railway cron 등에서 하루 한 번)
+#   파티션 이전(migrate)은 여기서 하지 않는다 -> services.meal_partitions 참고
+import gzip
+import json
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from db import SessionLocal, engine, ensure_tables
+from models import MealArchive, MealLog
+from services.meal_partitions import (
+    add_months,
+    ensure_meal_partitions,
+    existing_partitions,
+    is_lock_timeout,
+    is_postgres,
+    month_key,
+    month_range,
+    partition_name,
+    set_lock_timeout,
+)
+
+MEAL_ARCHIVE_HORIZON_DAYS = int(os.getenv("MEAL_ARCHIVE_HORIZON_DAYS", "90"))
+
+_COLUMNS = [c.name for c in MealLog.__table__.columns]
+_DELETE_CHUNK = 500
+
+def _to_utc(dt: datetime) -> datetime:
+    # SQLite는 tz 정보를 버리므로 UTC로 간주
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def _row_values(row: MealLog) -> Dict[str, Any]:
+    values = {c: getattr(row, c) for c in _COLUMNS}
+    values["created_at"] = _to_utc(values["created_at"]).isoformat()
+    return values
+
+
+def _encode(records: List[Dict[str, Any]]) -> bytes:
+    payload = {"columns": {c: [r[c] for r in records] for c in _COLUMNS}}
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return gzip.compress(raw, compresslevel=9)
+
+
+def _decode(data: bytes) -> List[Dict[str, Any]]:
+    cols = json.loads(gzip.decompress(data))["columns"]
+    return [{c: cols[c][i] for c in _COLUMNS} for i in range(len(cols["id"]))]
+
+
+def _save(archive: MealArchive, records: List[Dict[str, Any]]) -> None:
+    # (meal_date asc, created_at desc) = list_meals_range 정렬 순서로 저장
+    records.sort(key=lambda r: r["created_at"], reverse=True)
+    records.sort(key=lambda r: r["meal_date"])
+    ids = [r["id"] for r in records]
+    archive.data = _encode(records)
+    archive.row_count = len(records)
+    archive.min_meal_id = min(ids)
+    archive.max_meal_id = max(ids)
+    archive.updated_at = datetime.now(timezone.utc)
+
+
+def _to_meal(values: Dict[str, Any]) -> MealLog:
+    values = dict(values)
+    values["created_at"] = datetime.fromisoformat(values["created_at"])
+    return MealLog(**values)
+
+
+def list_archived_meals_range(db: Session, user_id: str, start_date: str, end_date: str) -> List[MealLog]:
+    """
+    아카이브에 있는 user_id의 [start_date, end_date] 기록.
+    세션에 붙지 않은 MealLog 객체로 돌려주므로 DB 행과 똑같이 다룰 수 있다.
+    """
+    archives = (
+        db.query(MealArchive)
+        .filter(
+            MealArchive.user_id == user_id,
+            MealArchive.month >= start_date[:7],
+            MealArchive.month <= end_date[:7],
+        )
+        .order_by(MealArchive.month.asc())
+        .all()
+    )
+    out: List[MealLog] = []
+    for archive in archives:
+        for values in _decode(archive.data):
+            if start_date <= values["meal_date"] <= end_date:
+                out.append(_to_meal(values))
+    return out
+
+
+def merge_meals(hot: List[MealLog], archived: List[MealLog]) -> List[MealLog]:
+    """
+    hot 테이블 + 아카이브 결과를 (meal_date asc, created_at desc) 순으로 합친다.
+    아카이브 쓰기와 hot 삭제가 한 트랜잭션이라 같은 기록이 양쪽에 보이는 일은 없으므로 중복 제거는 하지 않는다.
+    """
+    if not archived:
+        return hot
+    rows = hot + archived
+    rows.sort(key=lambda r: _to_utc(r.created_at), reverse=True)
+    rows.sort(key=lambda r: r.meal_date)
+    return rows
+
+
+def delete_archived_meal(db: Session, user_id: str, meal_id: int) -> bool:
+    """아카이브된 기록 삭제. blob을 다시 써서 해당 행을 뺀다."""
+    archives = (
+        db.query(MealArchive)
+        .filter(
+            MealArchive.user_id == user_id,
+            MealArchive.min_meal_id <= meal_id,
+            MealArchive.max_meal_id >= meal_id,
+        )
+        .with_for_update()
+        .all()
+    )
+    for archive in archives:
+        records = _decode(archive.data)
+        kept = [r for r in records if r["id"] != meal_id]
+        if len(kept) == len(records):
+            continue
+        if kept:
+            _save(archive, kept)
+        else:
+            db.delete(archive)
+        db.commit()
+        return True
+    db.rollback()
+    return False
+
+
+def _append(db: Session, user_id: str, month: str, rows: List[MealLog]) -> None:
+    archive = (
+        db.query(MealArchive)
+        .filter(MealArchive.user_id == user_id, MealArchive.month == month)
+        .with_for_update()
+        .first()
+    )
+    records = _decode(archive.data) if archive else []
+    archived_ids = {r["id"] for r in records}
+    collided = sorted(r.id for r in rows if r.id in archived_ids)
+    if collided:
+        # id가 재사용된 상태에서 덮어쓰면 기존 기록이 사라진다 -> 옮기지 않고 중단 (hot 행은 그대로 남음)
+        raise RuntimeError(f"meal id collision in archive {user_id}/{month}: {collided[:10]}")
+    if archive is None:
+        archive = MealArchive(user_id=user_id, month=month)
+        db.add(archive)
+    _save(archive, records + [_row_values(r) for r in rows])
+
+
+def archive_cutoff_month(today: Optional[date] = None, horizon_days: int = MEAL_ARCHIVE_HORIZON_DAYS) -> str:
+    """이 달(YYYY-MM)보다 이전 달은 전부 horizon 밖이므로 아카이브 대상."""
+    return month_key((today or date.today()) - timedelta(days=horizon_days))
+
+
+def _drop_partition_if_empty(db: Session, partition: str) -> None:
+    # DROP 은 부모 meal_logs 에도 ACCESS EXCLUSIVE 가 필요하다. 열린 트랜잭션 때문에 오래 기다리면
+    # API 쿼리가 그 뒤로 줄을 서므로 lock_timeout 안에 못 잡으면 다음 실행으로 미룬다.
+    try:
+        set_lock_timeout(db.connection())
+        db.execute(text(f"LOCK TABLE {partition} IN ACCESS EXCLUSIVE MODE"))
+        # 잠근 뒤 다시 확인: 그 사이 늦게 들어온 기록이 있으면 다음 실행에서 옮긴다
+        if db.execute(text(f"SELECT 1 FROM {partition} LIMIT 1")).first() is None:
+            db.execute(text(f"DROP TABLE {partition}"))
+        db.commit()
+    except OperationalError as e:
+        db.rollback()
+        if not is_lock_timeout(e):
+            raise
+
+
+def _require_autoincrement(db: Session) -> None:
+    """
+    SQLite는 AUTOINCREMENT 없이 만든 테이블이면 지워진 최대 id를 다시 쓴다.
+    아카이브된 id가 새 기록에 재사용되면 목록/삭제가 꼬이므로 그런 테이블은 아카이브하지 않는다.
+    (models.MealLog 는 sqlite_autoincrement 로 만들어지지만, 그 전에 만들어진 테이블에는 적용되지 않음)
+    """
+    ddl = db.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": MealLog.__tablename__},
+    ).scalar()
+    if ddl and "AUTOINCREMENT" not in ddl.upper():
+        raise RuntimeError(
+            "meal_logs was created without AUTOINCREMENT; archived ids could be reused. "
+            "Rebuild the table with AUTOINCREMENT before archiving."
+        )
+
+
+def archive_old_meals(
+    db: Session,
+    today: Optional[date] = None,
+    horizon_days: int = MEAL_ARCHIVE_HORIZON_DAYS,
+) -> Dict[str, int]:
+    """
+    horizon_days보다 오래된 '완전히 지난 달'의 기록을 meal_archives로 옮기고 hot 테이블에서 지운다.
+    (user_id, 월) 단위로 읽고 → 아카이브에 쓰고 → 지우고 → commit 하므로 메모리는 한 사용자 한 달치만 쓴다.
+    Postgres에서는 다 비운 달 파티션을 DROP 한다.
+    반환값: {월: 옮긴 행 수}
+    """
+    cutoff = archive_cutoff_month(today, horizon_days)
+    postgres = is_postgres(db.get_bind())
+    partitions = existing_partitions(db.connection()) if postgres else set()
+
+    if not postgres:
+        _require_autoincrement(db)
+
+    # 가장 오래된 hot 기록 또는 (비어 있을 수 있는) 가장 오래된 월 파티션부터 시작
+    candidates = [p[len("meal_logs_"):].replace("_", "-") for p in partitions if p[-2:].isdigit()]
+    oldest = db.query(MealLog.meal_date).order_by(MealLog.meal_date.asc()).first()
+    if oldest:
+        candidates.append(oldest[0][:7])
+    if not candidates or min(candidates) >= cutoff:
+        return {}
+
+    moved: Dict[str, int] = {}
+    for month in month_range(min(candidates), add_months(cutoff, -1)):
+        start, end = f"{month}-01", f"{add_months(month, 1)}-01"
+        user_ids = [
+            r[0]
+            for r in db.query(MealLog.user_id)
+            .filter(MealLog.meal_date >= start, MealLog.meal_date < end)
+            .distinct()
+            .all()
+        ]
+        for user_id in user_ids:
+            rows = (
+                db.query(MealLog)
+                .filter(MealLog.user_id == user_id, MealLog.meal_date >= start, MealLog.meal_date < end)
+                .all()
+            )
+            if not rows:
+                continue
+            _append(db, user_id, month, rows)
+            # 아카이브에 쓴 행만 지운다 (그 사이 들어온 기록은 다음 실행 때 옮겨짐)
+            ids = [r.id for r in rows]
+            for i in range(0, len(ids), _DELETE_CHUNK):
+                db.query(MealLog).filter(
+                    MealLog.meal_date >= start,
+                    MealLog.meal_date < end,
+                    MealLog.id.in_(ids[i:i + _DELETE_CHUNK]),
+                ).delete(synchronize_session=False)
+            db.commit()
+            db.expunge_all()
+            moved[month] = moved.get(month, 0) + len(rows)
+
+        partition = partition_name(month)
+        if partition in partitions:
+            _drop_partition_if_empty(db, partition)
+    return moved
+
+
+def run() -> Dict[str, int]:
+    ensure_meal_partitions()
+    if not inspect(engine).has_table(MealLog.__tablename__):
+        return {}
+    ensure_tables(MealArchive.__table__)
+    with SessionLocal() as db:
+        return archive_old_meals(db)
+
+
+if __name__ == "__main__":
+    result = run()
+    print(json.dumps({"archived": result}, ensure_ascii=False))
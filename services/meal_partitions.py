@@ -0,0 +1,258 @@
+# meal_logs 월 단위 파티셔닝
+# - Postgres: meal_date 기준 RANGE 파티션 + meal_logs_YYYY_MM 파티션을 미리 생성.
+#   인덱스가 파티션마다 따로 잡히므로 최근 몇 달치 인덱스만 hot하게 유지된다.
+# - SQLite: 파티셔닝이 없으므로 테이블은 그대로 두고, 오래된 달은
+#   services.meal_archive 가 아카이브로 옮긴 뒤 삭제해서 같은 효과를 낸다.
+# - 기존 일반 테이블 -> 파티션 테이블 이전은 meal_logs 전체를 잠그므로 cron에서 하지 않고
+#   점검 시간에 따로 실행한다: python -m services.meal_partitions migrate
+import os
+from datetime import date
+from typing import Iterable, List, Optional
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+
+from db import engine as default_engine
+
+MEAL_PARTITION_MONTHS_AHEAD = int(os.getenv("MEAL_PARTITION_MONTHS_AHEAD", "2"))
+# cron의 파티션 DDL(CREATE/ATTACH/DROP)이 meal_logs 잠금을 오래 기다리면 그 뒤로 API 쿼리가 줄을 선다
+# -> 이 시간 안에 못 잡으면 포기하고 다음 실행으로 미룬다
+MEAL_PARTITION_LOCK_TIMEOUT_MS = int(os.getenv("MEAL_PARTITION_LOCK_TIMEOUT_MS", "2000"))
+
+_TABLE = "meal_logs"
+_DEFAULT_PARTITION = "meal_logs_default"
+
+# models.MealLog 와 동일한 컬럼/인덱스. 파티션 키(meal_date)가 PK에 포함되어야 해서 직접 DDL로 만든다.
+_CREATE_PARTITIONED = f"""
+CREATE TABLE {_TABLE} (
+    id SERIAL NOT NULL,
+    user_id VARCHAR(128) NOT NULL,
+    email VARCHAR(256) NOT NULL,
+    meal_date VARCHAR(10) NOT NULL,
+    input_type VARCHAR(16) NOT NULL,
+    input_text TEXT NOT NULL,
+    description TEXT NOT NULL,
+    calories_kcal FLOAT NOT NULL,
+    protein_g FLOAT NOT NULL,
+    confidence FLOAT NOT NULL,
+    notes TEXT NOT NULL,
+    warnings TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (id, meal_date)
+) PARTITION BY RANGE (meal_date)
+"""
+
+_INDEXES = {
+    "ix_meal_logs_user_id": "(user_id)",
+    "ix_meal_logs_email": "(email)",
+    "ix_meal_logs_meal_date": "(meal_date)",
+    "ix_meal_logs_created_at": "(created_at)",
+    "ix_meal_logs_user_date": "(user_id, meal_date)",
+}
+
+_COLUMNS = (
+    "id, user_id, email, meal_date, input_type, input_text, description, "
+    "calories_kcal, protein_g, confidence, notes, warnings, created_at"
+)
+
+
+def month_key(d: date) -> str:
+    """date -> 'YYYY-MM'"""
+    return f"{d.year:04d}-{d.month:02d}"
+
+
+def add_months(month: str, n: int) -> str:
+    y, m = (int(x) for x in month.split("-"))
+    total = y * 12 + (m - 1) + n
+    return f"{total // 12:04d}-{total % 12 + 1:02d}"
+
+
+def month_range(start_month: str, end_month: str) -> List[str]:
+    out = []
+    m = start_month
+    while m <= end_month:
+        out.append(m)
+        m = add_months(m, 1)
+    return out
+
+
+def partition_name(month: str) -> str:
+    return f"{_TABLE}_{month.replace('-', '_')}"
+
+
+def is_postgres(bind: Engine | Connection) -> bool:
+    return bind.dialect.name == "postgresql"
+
+
+def set_lock_timeout(conn: Connection) -> None:
+    # SET LOCAL: 현재 트랜잭션에만 적용
+    conn.execute(text(f"SET LOCAL lock_timeout = {MEAL_PARTITION_LOCK_TIMEOUT_MS}"))
+
+
+def is_lock_timeout(e: OperationalError) -> bool:
+    # 55P03 = lock_not_available (psycopg2: pgcode, psycopg3: sqlstate)
+    code = getattr(e.orig, "pgcode", None) or getattr(e.orig, "sqlstate", None)
+    return code == "55P03"
+
+
+def _is_partitioned(conn: Connection) -> bool:
+    row = conn.execute(
+        text(
+            "SELECT 1 FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+        ),
+        {"name": _TABLE},
+    ).first()
+    return row is not None
+
+
+def existing_partitions(conn: Connection) -> set[str]:
+    rows = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :name AND pg_table_is_visible(p.oid)"
+        ),
+        {"name": _TABLE},
+    ).all()
+    return {r[0] for r in rows}
+
+
+def _create_partition(conn: Connection, month: str, have: set[str]) -> None:
+    name = partition_name(month)
+    # 문자열 'YYYY-MM-DD' 비교이므로 [YYYY-MM-01, 다음달-01) 범위가 한 달
+    lo, hi = f"{month}-01", f"{add_months(month, 1)}-01"
+    bounds = {"lo": lo, "hi": hi}
+
+    in_default = _DEFAULT_PARTITION in have and conn.execute(
+        text(f"SELECT 1 FROM {_DEFAULT_PARTITION} WHERE meal_date >= :lo AND meal_date < :hi LIMIT 1"),
+        bounds,
+    ).first()
+    if not in_default:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF {_TABLE} FOR VALUES FROM ('{lo}') TO ('{hi}')"))
+        return
+
+    # 미리 만들어 둔 범위보다 먼 날짜로 들어온 기록이 default에 있으면 PARTITION OF 가 실패한다
+    # -> 따로 만든 테이블로 default의 해당 달 행을 옮긴 뒤 ATTACH
+    conn.execute(text(f"LOCK TABLE {_DEFAULT_PARTITION} IN SHARE ROW EXCLUSIVE MODE"))
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {_TABLE} INCLUDING DEFAULTS)"))
+    conn.execute(
+        text(
+            f"WITH moved AS ("
+            f"DELETE FROM {_DEFAULT_PARTITION} WHERE meal_date >= :lo AND meal_date < :hi RETURNING {_COLUMNS}"
+            f") INSERT INTO {name} ({_COLUMNS}) SELECT {_COLUMNS} FROM moved"
+        ),
+        bounds,
+    )
+    conn.execute(text(f"ALTER TABLE {_TABLE} ATTACH PARTITION {name} FOR VALUES FROM ('{lo}') TO ('{hi}')"))
+
+
+def _create_partitions(conn: Connection, months: Iterable[str]) -> None:
+    have = existing_partitions(conn)
+    for month in months:
+        if partition_name(month) not in have:
+            _create_partition(conn, month, have)
+    if _DEFAULT_PARTITION not in have:
+        # 파티션이 없는 달(아카이브된 과거 달에 늦게 들어온 기록 등)은 default로 받아서 insert가 실패하지 않게 함
+        conn.execute(text(f"CREATE TABLE {_DEFAULT_PARTITION} PARTITION OF {_TABLE} DEFAULT"))
+
+
+def _create_partitioned_table(conn: Connection) -> None:
+    conn.execute(text(_CREATE_PARTITIONED))
+    for name, cols in _INDEXES.items():
+        conn.execute(text(f"CREATE INDEX {name} ON {_TABLE} {cols}"))
+
+
+def _migrate_legacy_table(conn: Connection) -> List[str]:
+    """
+    일반 테이블로 만들어진 기존 meal_logs를 파티션 테이블로 옮긴다. (한 트랜잭션)
+    기존 데이터가 걸친 달의 파티션도 같이 만든다.
+    """
+    conn.execute(text(f"ALTER TABLE {_TABLE} RENAME TO {_TABLE}_legacy"))
+    for name in _INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    _create_partitioned_table(conn)
+
+    bounds = conn.execute(text(f"SELECT MIN(meal_date), MAX(meal_date) FROM {_TABLE}_legacy")).first()
+    months: List[str] = []
+    if bounds and bounds[0]:
+        months = month_range(bounds[0][:7], bounds[1][:7])
+    _create_partitions(conn, months)
+
+    conn.execute(
+        text(
+            f"INSERT INTO {_TABLE} ({_COLUMNS}) "
+            f"SELECT id, user_id, COALESCE(email, ''), meal_date, input_type, COALESCE(input_text, ''), "
+            f"COALESCE(description, ''), COALESCE(calories_kcal, 0), COALESCE(protein_g, 0), "
+            f"COALESCE(confidence, 0), COALESCE(notes, ''), COALESCE(warnings, '[]'), "
+            f"COALESCE(created_at, now()) FROM {_TABLE}_legacy"
+        )
+    )
+    conn.execute(
+        text(
+            f"SELECT setval(pg_get_serial_sequence('{_TABLE}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {_TABLE}), 0) + 1, false)"
+        )
+    )
+    conn.execute(text(f"DROP TABLE {_TABLE}_legacy"))
+    return months
+
+
+def ensure_meal_partitions(
+    bind: Optional[Engine] = None,
+    today: Optional[date] = None,
+    months_ahead: int = MEAL_PARTITION_MONTHS_AHEAD,
+) -> List[str]:
+    """
+    이번 달 ~ months_ahead 달 뒤까지 파티션이 있도록 보장한다. (cron에서 매일 호출해도 가벼움)
+    meal_logs가 없으면 파티션 테이블로 만든다. 아직 일반 테이블이면 건드리지 않는다 -> migrate 필요.
+    Postgres가 아니면 아무것도 하지 않는다. 반환값은 보장한 달 목록.
+    """
+    bind = bind or default_engine
+    if not is_postgres(bind):
+        return []
+
+    current = month_key(today or date.today())
+    months = month_range(current, add_months(current, months_ahead))
+
+    try:
+        with bind.begin() as conn:
+            set_lock_timeout(conn)
+            if not inspect(conn).has_table(_TABLE):
+                _create_partitioned_table(conn)
+            elif not _is_partitioned(conn):
+                return []
+            _create_partitions(conn, months)
+    except OperationalError as e:
+        if not is_lock_timeout(e):
+            raise
+        return []
+    return months
+
+
+def migrate_meal_logs_to_partitions(bind: Optional[Engine] = None) -> List[str]:
+    """
+    기존 일반 meal_logs를 파티션 테이블로 이전한다. 한 트랜잭션 동안 meal_logs 전체가
+    ACCESS EXCLUSIVE로 잠기므로 점검 시간에 직접 실행할 것. 이미 파티션 테이블이면 아무것도 안 함.
+    """
+    bind = bind or default_engine
+    if not is_postgres(bind):
+        return []
+    with bind.begin() as conn:
+        if not inspect(conn).has_table(_TABLE) or _is_partitioned(conn):
+            return []
+        months = _migrate_legacy_table(conn)
+    # 이번 달 이후 파티션은 평소 경로로
+    return sorted(set(months) | set(ensure_meal_partitions(bind)))
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] == ["migrate"]:
+        print(migrate_meal_logs_to_partitions())
+    else:
+        print(ensure_meal_partitions())